@@ -80,10 +80,9 @@ def _get_sequences(wikipedia_path=None,
     ))
 
   def _segment(article):
-    return filter(
-        None,
-        map(lambda s: s.strip(), nltk.tokenize.sent_tokenize(article)),
-    )
+    return [
+        s for s in map(str.strip, nltk.tokenize.sent_tokenize(article)) if s
+    ]
 
   def _aggregate_sentences(sentences):
     # Cutting sentences into chunks that are close to target_seq_length
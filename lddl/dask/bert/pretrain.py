@@ -27,214 +27,205 @@ import dask
 import dask.bag as db
 import dask.distributed
 import functools
-import json
+import itertools
 import nltk
 import numpy as np
 import os
 import pyarrow as pa
+import pyarrow.parquet as pq
 import random
+import threading
 import time
 import transformers
-from collections import deque, namedtuple
 
 from ..readers import (read_wikipedia, read_books, read_common_crawl,
                        split_id_text, estimate_block_size)
-from lddl.utils import (expand_outdir_and_mkdir, attach_bool_arg,
-                        serialize_np_array, deserialize_np_array)
+from lddl.utils import expand_outdir_and_mkdir, attach_bool_arg
 from lddl.download.utils import parse_str_of_num_bytes
 
-from .binning import to_textfiles_binned, to_dataframe_binned, to_parquet_binned
-
-
-class Sentence:
-
-  def __init__(self, tokens):
-    self._tokens = tokens
-
-  def __repr__(self):
-    return 'Sentence(_tokens={})'.format(self._tokens)
-
-  def __len__(self):
-    return len(self._tokens)
+from .binning import to_textfiles_binned
 
 
 class Document:
 
-  def __init__(self, doc_id, sentences):
+  def __init__(self, doc_id, tokens, sentence_offsets):
     self._id = doc_id
-    self._sentences = sentences
+    # The tokens of all sentences are stored back to back, such that the i-th
+    # sentence is tokens[sentence_offsets[i]:sentence_offsets[i + 1]].
+    self._tokens = tokens
+    self._sentence_offsets = sentence_offsets
 
   def __repr__(self):
-    return 'Document(_id={}, _sentences={})'.format(self._id, self._sentences)
+    return 'Document(_id={}, _tokens={}, _sentence_offsets={})'.format(
+        self._id,
+        self._tokens,
+        self._sentence_offsets,
+    )
 
   def __len__(self):
-    return len(self._sentences)
+    return len(self._sentence_offsets) - 1
 
   def __getitem__(self, idx):
-    return self._sentences[idx]
+    offsets = self._sentence_offsets
+    return self._tokens[offsets[idx]:offsets[idx + 1]]
 
+  def get_tokens(self, start, end):
+    """Returns the tokens of the sentences in [start, end) as a list."""
+    offsets = self._sentence_offsets
+    return list(self._tokens[offsets[start]:offsets[end]])
 
-def _get_documents(bag_texts, tokenizer, max_length=512):
 
-  def _tokenize(s):
-    return tokenizer.tokenize(s, max_length=max_length, truncation=True)
-
-  def _to_document(raw_text):
+def _to_documents(raw_texts, tokenizer, max_length=512):
+  doc_ids, doc_num_sentences, all_sentence_strs = [], [], []
+  for raw_text in raw_texts:
     doc_id, text = split_id_text(raw_text)
-    sentence_strs = filter(
-        None,
-        map(lambda s: s.strip(), nltk.tokenize.sent_tokenize(text)),
-    )
-
-    sentences = (Sentence(tuple(tokens))
-                 for tokens in (
-                     _tokenize(sentence_str) for sentence_str in sentence_strs)
-                 if len(tokens) > 0)
-
-    document = Document(doc_id, tuple(sentences))
-    return document
-
-  return bag_texts.map(_to_document).filter(lambda d: len(d._sentences) > 0)
+    sentence_strs = [
+        s for s in map(str.strip, nltk.tokenize.sent_tokenize(text)) if s
+    ]
+    doc_ids.append(doc_id)
+    doc_num_sentences.append(len(sentence_strs))
+    all_sentence_strs.extend(sentence_strs)
+  if len(all_sentence_strs) == 0:
+    return []
+
+  # Tokenize all sentences in this partition with a single call, so that the
+  # fast tokenizer can process them as one batch. Sentences that occur more
+  # than once in this partition are only tokenized once.
+  unique_sentence_strs = list(dict.fromkeys(all_sentence_strs))
+  encoded = tokenizer(
+      unique_sentence_strs,
+      add_special_tokens=False,
+      truncation=True,
+      max_length=max_length,
+      return_attention_mask=False,
+      return_token_type_ids=False,
+  )
+  sentence_tokens_of = dict(
+      zip(
+          unique_sentence_strs,
+          map(encoded.tokens, range(len(unique_sentence_strs))),
+      ))
+  all_tokens = map(sentence_tokens_of.__getitem__, all_sentence_strs)
+
+  documents = []
+  for doc_id, num_sentences in zip(doc_ids, doc_num_sentences):
+    tokens, sentence_offsets = [], [0]
+    for sentence_tokens in itertools.islice(all_tokens, num_sentences):
+      if len(sentence_tokens) > 0:
+        tokens.extend(sentence_tokens)
+        sentence_offsets.append(len(tokens))
+    if len(sentence_offsets) > 1:
+      documents.append(
+          Document(
+              doc_id,
+              tuple(tokens),
+              np.asarray(sentence_offsets, dtype=np.int32),
+          ))
+  return documents
 
 
 def _shuffle_bag_texts(bag_texts):
 
-  return bag_texts.map(lambda text: {
-      'text': text,
-      'on': random.random(),
-  }).to_dataframe(meta={
+  def _assign_random_keys(df):
+    return df.assign(on=np.random.default_rng().random(len(df)))
+
+  return bag_texts.to_dataframe(meta={
       'text': str,
-      'on': float,
-  }).shuffle(
+  }).map_partitions(
+      _assign_random_keys,
+      meta={
+          'text': str,
+          'on': float,
+      },
+  ).shuffle(
       'on',
       ignore_index=True,
-  ).sample(frac=1.0).to_bag().map(lambda t: t[0])
+      shuffle='tasks',
+  ).sample(frac=1.0)['text'].to_bag()
 
 
-def _cut(lcut, tokens, rcut):
-  if random.random() > 0.5:
-    rcut.appendleft(tokens.pop())
-  else:
-    lcut.append(tokens.popleft())
+def _num_cuts(len_A, len_B, max_length):
+  # Repeatedly removing one token from the longer sequence (B on ties) until
+  # the pair fits has a closed form, so the number of tokens to remove from
+  # each sequence can be computed without looping over the tokens.
+  num_over = len_A + len_B - max_length
+  if num_over <= 0:
+    return 0, 0
+  if num_over <= abs(len_A - len_B):
+    return (num_over, 0) if len_A > len_B else (0, num_over)
+  return len_A - (max_length + 1) // 2, len_B - max_length // 2
 
 
-def _is_following_subword(word):
-  return word[:2] == '##' and len(word) > 2 and word[3:].isalpha()
+def _cut(tokens, num_cuts, rng):
+  # Each cut removes a token from the back with a probability of 0.5, so the
+  # number of tokens removed from the back follows a binomial distribution.
+  num_rcuts = rng.binomial(num_cuts, 0.5) if num_cuts > 0 else 0
+  return num_cuts - num_rcuts, len(tokens) - num_rcuts
 
 
-def _adjust(lcut, tokens, rcut):
-  inclusive = (random.random() > 0.5)
-  while len(tokens) > 0 and _is_following_subword(tokens[0]):
-    if inclusive:
-      if len(lcut) == 0:
-        break
-      tokens.appendleft(lcut.pop())
-    else:
-      lcut.append(tokens.popleft())
-  inclusive = (random.random() > 0.5)
-  while len(rcut) > 0 and _is_following_subword(rcut[0]):
-    if inclusive:
-      tokens.append(rcut.popleft())
-    else:
-      if len(tokens) == 0:
-        break
-      rcut.appendleft(tokens.pop())
-
-
-def _truncate(tokens_A, tokens_B, max_length):
-  tokens_A, tokens_B = deque(tokens_A), deque(tokens_B)
-  lcut_A, rcut_A = deque([]), deque([])
-  lcut_B, rcut_B = deque([]), deque([])
-
-  # Truncate each sequence into 3 pieces: lcut, tokens, rcut
-  while len(tokens_A) + len(tokens_B) > max_length:
-    if len(tokens_A) > len(tokens_B):
-      _cut(lcut_A, tokens_A, rcut_A)
-    else:
-      _cut(lcut_B, tokens_B, rcut_B)
-
-  _adjust(lcut_A, tokens_A, rcut_A)
-  _adjust(lcut_B, tokens_B, rcut_B)
-  return tuple(tokens_A), tuple(tokens_B)
-
-
-def _truncate_seq_pair(tokens_a, tokens_b, max_num_tokens):
+def _truncate_seq_pair(tokens_a, tokens_b, max_num_tokens, rng):
   """Truncates a pair of sequences to a maximum sequence length."""
-  while True:
-    total_length = len(tokens_a) + len(tokens_b)
-    if total_length <= max_num_tokens:
-      break
-
-    trunc_tokens = tokens_a if len(tokens_a) > len(tokens_b) else tokens_b
-    assert len(trunc_tokens) >= 1
-
+  for trunc_tokens, num_cuts in zip(
+      (tokens_a, tokens_b),
+      _num_cuts(len(tokens_a), len(tokens_b), max_num_tokens),
+  ):
     # We want to sometimes truncate from the front and sometimes from the
     # back to add more randomness and avoid biases.
-    if random.random() < 0.5:
-      del trunc_tokens[0]
-    else:
-      trunc_tokens.pop()
-
+    start, end = _cut(trunc_tokens, num_cuts, rng)
+    del trunc_tokens[end:]
+    del trunc_tokens[:start]
 
-MaskedLmInstance = namedtuple("MaskedLmInstance", ["index", "label"])
 
-
-def create_masked_lm_predictions(tokens_a, tokens_b, masked_lm_ratio,
-                                 vocab_words):
+def create_masked_lm_predictions(tokens_a,
+                                 tokens_b,
+                                 masked_lm_ratio,
+                                 vocab_words,
+                                 rng=None):
   """Creates the predictions for the masked LM objective."""
+  if rng is None:
+    rng = np.random.default_rng()
+  # A no-op when vocab_words is already an object ndarray, as in _get_pairs.
+  vocab_words = np.asarray(vocab_words, dtype=object)
   num_tokens_a, num_tokens_b = len(tokens_a), len(tokens_b)
   tokens = ['[CLS]'] + tokens_a + ['[SEP]'] + tokens_b + ['[SEP]']
 
-  cand_indexes = []
-  for (i, token) in enumerate(tokens):
-    if token == "[CLS]" or token == "[SEP]":
-      continue
-    cand_indexes.append(i)
-
-  random.shuffle(cand_indexes)
+  cand_indexes = [
+      i for i, token in enumerate(tokens)
+      if token != '[CLS]' and token != '[SEP]'
+  ]
 
-  output_tokens = list(tokens)
-
-  num_to_predict = max(1, int(round(len(tokens) * masked_lm_ratio)))
-
-  masked_lms = []
-  covered_indexes = set()
-  for index in cand_indexes:
-    if len(masked_lms) >= num_to_predict:
-      break
-    if index in covered_indexes:
-      continue
-    covered_indexes.add(index)
-
-    masked_token = None
-    # 80% of the time, replace with [MASK]
-    if random.random() < 0.8:
-      masked_token = "[MASK]"
-    else:
-      # 10% of the time, keep original
-      if random.random() < 0.5:
-        masked_token = tokens[index]
-      # 10% of the time, replace with random word
-      else:
-        masked_token = vocab_words[random.randint(0, len(vocab_words) - 1)]
-
-    output_tokens[index] = masked_token
-
-    masked_lms.append(MaskedLmInstance(index=index, label=tokens[index]))
-
-  masked_lms = sorted(masked_lms, key=lambda x: x.index)
-
-  masked_lm_positions = []
-  masked_lm_labels = []
-  for p in masked_lms:
-    masked_lm_positions.append(p.index)
-    masked_lm_labels.append(p.label)
+  num_to_predict = min(
+      len(cand_indexes),
+      max(1, int(round(len(tokens) * masked_lm_ratio))),
+  )
+  # Mark the chosen positions in a mask so that they come out in order without
+  # a sort.
+  is_masked = np.zeros(len(tokens), dtype=bool)
+  # An empty list would be permuted into a float array, which cannot index.
+  is_masked[rng.permutation(np.asarray(cand_indexes, dtype=np.intp))
+            [:num_to_predict]] = True
+  masked_lm_positions = np.flatnonzero(is_masked)
+
+  output_tokens = np.array(tokens, dtype=object)
+  masked_lm_labels = output_tokens[masked_lm_positions]
+
+  # 80% of the time, replace with [MASK]; 10% of the time, keep original; 10%
+  # of the time, replace with random word.
+  masked_tokens = masked_lm_labels.copy()
+  to_mask = rng.random(num_to_predict) < 0.8
+  to_randomize = ~to_mask & (rng.random(num_to_predict) >= 0.5)
+  masked_tokens[to_mask] = '[MASK]'
+  masked_tokens[to_randomize] = vocab_words[rng.integers(
+      len(vocab_words),
+      size=np.count_nonzero(to_randomize),
+  )]
+  output_tokens[masked_lm_positions] = masked_tokens
 
   return (
-      output_tokens[1:1 + num_tokens_a],
-      output_tokens[2 + num_tokens_a:2 + num_tokens_a + num_tokens_b],
-      masked_lm_positions,
-      masked_lm_labels,
+      output_tokens[1:1 + num_tokens_a].tolist(),
+      output_tokens[2 + num_tokens_a:2 + num_tokens_a + num_tokens_b].tolist(),
+      masked_lm_positions.astype(np.uint16),
+      masked_lm_labels.tolist(),
   )
 
 
@@ -246,8 +237,11 @@ def create_pairs_from_document(
     masking=False,
     masked_lm_ratio=0.15,
     vocab_words=None,
+    rng=None,
 ):
   """Create a pair for a single document."""
+  if rng is None:
+    rng = np.random.default_rng()
   document = all_documents[document_index]
 
   # Account for [CLS], [SEP], [SEP]
@@ -270,101 +264,128 @@ def create_pairs_from_document(
   # segments "A" and "B" based on the actual "sentences" provided by the user
   # input.
   instances = []
-  current_chunk = []
-  current_length = 0
-  i = 0
-  while i < len(document):
-    segment = document[i]
-    current_chunk.append(segment)
-    current_length += len(segment)
-    if i == len(document) - 1 or current_length >= target_seq_length:
-      if current_chunk:
-        # `a_end` is how many segments from `current_chunk` go into the `A`
-        # (first) sentence.
-        a_end = 1
-        if len(current_chunk) >= 2:
-          a_end = random.randint(1, len(current_chunk) - 1)
-
-        tokens_a = []
-        for j in range(a_end):
-          tokens_a.extend(current_chunk[j]._tokens)
-
-        tokens_b = []
-        # Random next
+  sentence_offsets = document._sentence_offsets
+  chunk_start = 0
+  while chunk_start < len(document):
+    # The current chunk consists of the sentences in [chunk_start, chunk_end),
+    # which is the fewest sentences that have at least `target_seq_length`
+    # tokens in total, or the rest of the document.
+    chunk_end = min(
+        int(
+            np.searchsorted(
+                sentence_offsets,
+                sentence_offsets[chunk_start] + target_seq_length,
+            )),
+        len(document),
+    )
+    num_chunk_segments = chunk_end - chunk_start
+    # `a_end` is how many segments from the current chunk go into the `A`
+    # (first) sentence.
+    a_end = 1
+    if num_chunk_segments >= 2:
+      a_end = random.randint(1, num_chunk_segments - 1)
+
+    tokens_a = document.get_tokens(chunk_start, chunk_start + a_end)
+
+    # Random next
+    is_random_next = False
+    if num_chunk_segments == 1 or random.random() < 0.5:
+      is_random_next = True
+      target_b_length = target_seq_length - len(tokens_a)
+
+      # This should rarely go for more than one iteration for large
+      # corpora. However, just to be careful, we try to make sure that
+      # the random document is not the same as the document
+      # we're processing.
+      for _ in range(10):
+        random_document_index = random.randint(0, len(all_documents) - 1)
+        if random_document_index != document_index:
+          break
+
+      #If picked random document is the same as the current document
+      if random_document_index == document_index:
         is_random_next = False
-        if len(current_chunk) == 1 or random.random() < 0.5:
-          is_random_next = True
-          target_b_length = target_seq_length - len(tokens_a)
-
-          # This should rarely go for more than one iteration for large
-          # corpora. However, just to be careful, we try to make sure that
-          # the random document is not the same as the document
-          # we're processing.
-          for _ in range(10):
-            random_document_index = random.randint(0, len(all_documents) - 1)
-            if random_document_index != document_index:
-              break
-
-          #If picked random document is the same as the current document
-          if random_document_index == document_index:
-            is_random_next = False
-
-          random_document = all_documents[random_document_index]
-          random_start = random.randint(0, len(random_document) - 1)
-          for j in range(random_start, len(random_document)):
-            tokens_b.extend(random_document[j]._tokens)
-            if len(tokens_b) >= target_b_length:
-              break
-          # We didn't actually use these segments so we "put them back" so
-          # they don't go to waste.
-          num_unused_segments = len(current_chunk) - a_end
-          i -= num_unused_segments
-        # Actual next
-        else:
-          is_random_next = False
-          for j in range(a_end, len(current_chunk)):
-            tokens_b.extend(current_chunk[j]._tokens)
-
-        _truncate_seq_pair(tokens_a, tokens_b, max_num_tokens)
-
-        assert len(tokens_a) >= 1
-        assert len(tokens_b) >= 1
-
-        if masking:
-          (
-              tokens_a,
-              tokens_b,
-              masked_lm_positions,
-              masked_lm_labels,
-          ) = create_masked_lm_predictions(
-              tokens_a,
-              tokens_b,
-              masked_lm_ratio,
-              vocab_words,
-          )
-          masked_lm_positions = serialize_np_array(
-              np.asarray(masked_lm_positions, dtype=np.uint16))
-
-        instance = {
-            'A': ' '.join(tokens_a),
-            'B': ' '.join(tokens_b),
-            'is_random_next': is_random_next,
-            'num_tokens': len(tokens_a) + len(tokens_b) + 3,
-        }
-
-        if masking:
-          instance.update({
-              'masked_lm_positions': masked_lm_positions,
-              'masked_lm_labels': ' '.join(masked_lm_labels),
-          })
-        instances.append(instance)
-      current_chunk = []
-      current_length = 0
-    i += 1
+
+      random_document = all_documents[random_document_index]
+      random_offsets = random_document._sentence_offsets
+      random_start = random.randint(0, len(random_document) - 1)
+      random_end = max(
+          random_start + 1,
+          min(
+              int(
+                  np.searchsorted(
+                      random_offsets,
+                      random_offsets[random_start] + target_b_length,
+                  )),
+              len(random_document),
+          ),
+      )
+      tokens_b = random_document.get_tokens(random_start, random_end)
+      # We didn't actually use these segments so we "put them back" so
+      # they don't go to waste.
+      num_unused_segments = num_chunk_segments - a_end
+      chunk_end -= num_unused_segments
+    # Actual next
+    else:
+      is_random_next = False
+      tokens_b = document.get_tokens(chunk_start + a_end, chunk_end)
+
+    _truncate_seq_pair(tokens_a, tokens_b, max_num_tokens, rng)
+
+    assert len(tokens_a) >= 1
+    assert len(tokens_b) >= 1
+
+    if masking:
+      (
+          tokens_a,
+          tokens_b,
+          masked_lm_positions,
+          masked_lm_labels,
+      ) = create_masked_lm_predictions(
+          tokens_a,
+          tokens_b,
+          masked_lm_ratio,
+          vocab_words,
+          rng=rng,
+      )
+
+    instance = {
+        'A': ' '.join(tokens_a),
+        'B': ' '.join(tokens_b),
+        'is_random_next': is_random_next,
+        'num_tokens': len(tokens_a) + len(tokens_b) + 3,
+    }
+
+    if masking:
+      instance.update({
+          'masked_lm_positions': masked_lm_positions,
+          'masked_lm_labels': ' '.join(masked_lm_labels),
+      })
+    instances.append(instance)
+    chunk_start = chunk_end
 
   return instances
 
 
+_thread_local = threading.local()
+
+
+def _get_tokenizer(vocab_file):
+  # Each worker thread loads the tokenizer once and reuses it across tasks,
+  # instead of having it pickled into every task. The fast tokenizer's
+  # truncation state is not safe to share, hence one copy per thread.
+  if not hasattr(_thread_local, 'tokenizers'):
+    _thread_local.tokenizers = {}
+  if vocab_file not in _thread_local.tokenizers:
+    if os.path.isfile(vocab_file):
+      tokenizer = transformers.BertTokenizerFast(vocab_file)
+    else:
+      tokenizer = transformers.BertTokenizerFast.from_pretrained(vocab_file)
+    vocab_words = np.array(tuple(tokenizer.vocab.keys()), dtype=object)
+    _thread_local.tokenizers[vocab_file] = (tokenizer, vocab_words)
+  return _thread_local.tokenizers[vocab_file]
+
+
 def _get_pairs(
     wikipedia_path=None,
     books_path=None,
@@ -377,14 +398,16 @@ def _get_pairs(
     duplicate_factor=5,
     sample_ratio=0.9,
     seed=12345,
-    tokenizer=None,
+    vocab_file=None,
     masking=False,
     masked_lm_ratio=0.15,
 ):
-  vocab_words = tuple(tokenizer.vocab.keys())
 
-  def _to_partition_pairs(partition_documents):
-    partition_documents = tuple(partition_documents)
+  def _to_partition_pairs(partition_texts):
+    tokenizer, vocab_words = _get_tokenizer(vocab_file)
+    partition_documents = _to_documents(partition_texts, tokenizer)
+    # One NumPy random generator per partition for the batched random draws.
+    rng = np.random.default_rng()
     partition_pairs = []
     for _ in range(duplicate_factor):
       for document_index in range(len(partition_documents)):
@@ -397,6 +420,7 @@ def _get_pairs(
                 masking=masking,
                 masked_lm_ratio=masked_lm_ratio,
                 vocab_words=vocab_words,
+                rng=rng,
             ))
     random.shuffle(partition_pairs)
     return partition_pairs
@@ -437,8 +461,31 @@ def _get_pairs(
         ))
   bag_texts = db.concat(bags)
   bag_texts = _shuffle_bag_texts(bag_texts)
-  bag_documents = _get_documents(bag_texts, tokenizer)
-  return bag_documents.map_partitions(_to_partition_pairs)
+  return bag_texts.map_partitions(_to_partition_pairs)
+
+
+def _pairs_to_table(pairs, schema):
+  return pa.Table.from_pydict(
+      {name: [p[name] for p in pairs] for name in schema.names},
+      schema=schema,
+  )
+
+
+def _write_parquet_partition(pairs, path, schema, bin_size=None, nbins=None):
+  if bin_size is None:
+    pq.write_table(_pairs_to_table(list(pairs), schema), path)
+  else:
+    binned_pairs = [[] for _ in range(nbins)]
+    for p in pairs:
+      bin_id = min((p['num_tokens'] - 1) // bin_size, nbins - 1)
+      binned_pairs[bin_id].append(p)
+    for bin_id in range(nbins):
+      table = _pairs_to_table(binned_pairs[bin_id], schema)
+      table = table.append_column(
+          'bin_id',
+          pa.array([bin_id] * len(table), type=pa.int64()),
+      )
+      pq.write_table(table, '{}_{}'.format(path, bin_id))
 
 
 def _save_parquet(
@@ -448,12 +495,6 @@ def _save_parquet(
     target_seq_length=128,
     masking=False,
 ):
-  base_meta = {
-      'A': str,
-      'B': str,
-      'is_random_next': bool,
-      'num_tokens': int,
-  }
   base_schema = {
       'A': pa.string(),
       'B': pa.string(),
@@ -461,41 +502,21 @@ def _save_parquet(
       'num_tokens': pa.uint16(),
   }
   if masking:
-    base_meta.update({
-        'masked_lm_positions': bytes,
-        'masked_lm_labels': str,
-    })
     base_schema.update({
-        'masked_lm_positions': pa.binary(),
+        'masked_lm_positions': pa.list_(pa.uint16()),
         'masked_lm_labels': pa.string()
     })
-  if bin_size is None:
-    pairs.to_dataframe(meta=base_meta).to_parquet(
-        path,
-        engine='pyarrow',
-        write_index=False,
-        schema=base_schema,
-    )
-  else:
-    nbins = target_seq_length // bin_size
-    pairs.to_dataframe = to_dataframe_binned
-    dfs = pairs.to_dataframe(
-        pairs,
-        meta=base_meta,
-        bin_size=bin_size,
-        nbins=nbins,
-    )
-    to_parquet_binned(
-        dfs,
-        path,
-        nbins,
-        engine='pyarrow',
-        write_index=False,
-        schema={
-            **base_schema,
-            'bin_id': pa.int64(),
-        },
-    )
+  schema = pa.schema(list(base_schema.items()))
+  nbins = None if bin_size is None else target_seq_length // bin_size
+  # Each partition is converted into an Arrow table straight from the pairs,
+  # without going through a pandas DataFrame.
+  dask.compute(*(dask.delayed(_write_parquet_partition)(
+      partition,
+      os.path.join(path, 'part.{}.parquet'.format(i)),
+      schema,
+      bin_size=bin_size,
+      nbins=nbins,
+  ) for i, partition in enumerate(pairs.to_delayed())))
 
 
 def _save_txt(
@@ -506,29 +527,44 @@ def _save_txt(
     masking=False,
 ):
   if masking:
-    pairs = pairs.map(
-        lambda p: 'is_random_next: {} - [CLS] {} [SEP] {} [SEP] '
-        '- masked_lm_positions: {} - masked_lm_labels: {} - {}'.format(
-            p['is_random_next'],
-            p['A'],
-            p['B'],
-            deserialize_np_array(p['masked_lm_positions']),
-            p['masked_lm_labels'],
-            p['num_tokens'],
-        ))
+    line_format = ('is_random_next: {} - [CLS] {} [SEP] {} [SEP] '
+                   '- masked_lm_positions: {} - masked_lm_labels: {} - {}')
+
+    def _to_lines(partition_pairs):
+      return [
+          line_format.format(
+              p['is_random_next'],
+              p['A'],
+              p['B'],
+              p['masked_lm_positions'],
+              p['masked_lm_labels'],
+              p['num_tokens'],
+          ) for p in partition_pairs
+      ]
   else:
-    pairs = pairs.map(
-        lambda p: 'is_random_next: {} - [CLS] {} [SEP] {} [SEP] - {}'.format(
-            p['is_random_next'],
-            p['A'],
-            p['B'],
-            p['num_tokens'],
-        ))
+    line_format = 'is_random_next: {} - [CLS] {} [SEP] {} [SEP] - {}'
+
+    def _to_lines(partition_pairs):
+      return [
+          line_format.format(
+              p['is_random_next'],
+              p['A'],
+              p['B'],
+              p['num_tokens'],
+          ) for p in partition_pairs
+      ]
+
+  lines = pairs.map_partitions(_to_lines)
   if bin_size is None:
-    db.core.to_textfiles(pairs, os.path.join(path, '*.txt'))
+    # Join each partition into a single string, so that each text file is
+    # written with a single write call.
+    db.core.to_textfiles(
+        lines.map_partitions(lambda ls: ['\n'.join(ls)]),
+        os.path.join(path, '*.txt'),
+    )
   else:
     nbins = target_seq_length // bin_size
-    to_textfiles_binned(pairs, os.path.join(path, '*.txt'), bin_size, nbins)
+    to_textfiles_binned(lines, os.path.join(path, '*.txt'), bin_size, nbins)
 
 
 def _save(
@@ -581,10 +617,9 @@ def main(args):
     )
 
   nltk.download('punkt')
-  if os.path.isfile(args.vocab_file):
-    tokenizer = transformers.BertTokenizerFast(args.vocab_file)
-  else:
-    tokenizer = transformers.BertTokenizerFast.from_pretrained(args.vocab_file)
+  # Load the tokenizer once up front, so that a bad --vocab-file fails here
+  # rather than inside the dask tasks.
+  _get_tokenizer(args.vocab_file)
 
   tic = time.perf_counter()
   pairs = _get_pairs(
@@ -599,7 +634,7 @@ def main(args):
       duplicate_factor=args.duplicate_factor,
       sample_ratio=args.sample_ratio,
       seed=args.seed,
-      tokenizer=tokenizer,
+      vocab_file=args.vocab_file,
       masking=args.masking,
       masked_lm_ratio=args.masked_lm_ratio,
   )
@@ -699,37 +734,35 @@ runtime with convergence impact.
       type=int,
       default=defaults['--local-n-workers'],
       help='The number of worker processes for the local scheduler; only used '
-      'when --schedule=local . Default: {}'.format(
-          defaults['--local-n-workers']),
+      'when --schedule=local . Default: %(default)s',
   )
   parser.add_argument(
       '--local-threads-per-worker',
       type=int,
       default=defaults['--local-threads-per-worker'],
       help='The number of Python user-level threads per worker process for the '
-      'local scheduler; only used when --schedule=local . Default: {}'.format(
-          defaults['--local-threads-per-worker']),
+      'local scheduler; only used when --schedule=local . Default: %(default)s',
   )
   parser.add_argument(
       '--wikipedia',
       type=str,
       default=defaults['--wikipedia'],
       help="The path to the 'source' subdirectory for the Wikipedia corpus. "
-      "Default: {}".format(defaults['--wikipedia']),
+      "Default: %(default)s",
   )
   parser.add_argument(
       '--books',
       type=str,
       default=defaults['--books'],
       help="The path to the 'source' subdirectory for the Toronto books corpus."
-      " Default: {}".format(defaults['--books']),
+      " Default: %(default)s",
   )
   parser.add_argument(
       '--common-crawl',
       type=str,
       default=defaults['--common-crawl'],
       help="The path to the 'source' subdirectory for the Common Crawl news "
-      "corpus. Default: {}".format(defaults['--common-crawl']),
+      "corpus. Default: %(default)s",
   )
   parser.add_argument(
       '--sink',
@@ -737,7 +770,7 @@ runtime with convergence impact.
       default=defaults['--sink'],
       required=True,
       help='The path to the directory that stores the output (parquet or txt) '
-      'files. Default: {}'.format(defaults['--sink']),
+      'files. Default: %(default)s',
   )
   parser.add_argument(
       '--output-format',
@@ -746,7 +779,7 @@ runtime with convergence impact.
       choices=['parquet', 'txt'],
       help='The format of the output files. parquet should always be used and '
       'will be used by default. txt is for debugging purpose only. Default: '
-      '{}'.format(defaults['--output-format']),
+      '%(default)s',
   )
   parser.add_argument(
       '--wikipedia-lang',
@@ -754,7 +787,7 @@ runtime with convergence impact.
       default=defaults['--wikipedia-lang'],
       choices=['en', 'zh'],
       help='The language type for the Wikipedia corpus. Currenly, only en is '
-      'supported. Default: {}'.format(defaults['--wikipedia-lang']),
+      'supported. Default: %(default)s',
   )
   parser.add_argument(
       '--target-seq-length',
@@ -765,8 +798,7 @@ runtime with convergence impact.
       "task. In the original BERT Pretraining task, Phase 1 requires "
       "--target-seq-length=128 whereas Phase 2 requires --target-seq-length=512"
       " . However, you can also be creative and set --target-seq-length to "
-      "other positive integers greater than 3. Default: {}".format(
-          defaults['--target-seq-length']),
+      "other positive integers greater than 3. Default: %(default)s",
   )
   parser.add_argument(
       '--short-seq-prob',
@@ -775,14 +807,13 @@ runtime with convergence impact.
       help="If all samples are long sequences, BERT would overfit to only long "
       "sequences. Therefore, you need to introduce shorter sequences sometimes."
       " This flag specifies the probability of a random variable X with the "
-      "Bernoulli distribution (i.e., X in {{0, 1}} and "
+      "Bernoulli distribution (i.e., X in {0, 1} and "
       "Pr(X = 1) = p = 1 - Pr(X = 0)), such that the value of X is drawn for "
       "every document/article and, when X = 1, the value of the targeted, "
       "maximum number of tokens for the '[CLS] A [SEP] B [SEP]' pair input "
       "sequences is a random integer following the uniform distribution "
       "between 2 and the value specified by --target-seq-length minus 3 (to "
-      "exclude the '[CLS]' and 'SEP' tokens). Default: {}".format(
-          defaults['--short-seq-prob']),
+      "exclude the '[CLS]' and 'SEP' tokens). Default: %(default)s",
   )
   parser.add_argument(
       '--block-size',
@@ -792,8 +823,7 @@ runtime with convergence impact.
       help='The size of each output parquet/txt shard. Since Dask cannot '
       'guarantee perfect load balance, this value is only used as an estimate. '
       'Only one of --block-size and --num-blocks needs to be set, since one '
-      'value can be derived from the other. Default: {}'.format(
-          defaults['--block-size']),
+      'value can be derived from the other. Default: %(default)s',
   )
   parser.add_argument(
       '--num-blocks',
@@ -802,8 +832,7 @@ runtime with convergence impact.
       help='The total number of the output parquet/txt shards. Since Dask '
       'cannot guarantee perfect load balance, this value is only used as an '
       'estimate. Only one of --block-size or --num-blocks needs to be set, '
-      'since one value can be derived from the other. Default: {}'.format(
-          defaults['--num-blocks']),
+      'since one value can be derived from the other. Default: %(default)s',
   )
   parser.add_argument(
       '--bin-size',
@@ -814,7 +843,7 @@ runtime with convergence impact.
       'if --bin-size is 64, the first bin contains sequences with 1 to 64 '
       'tokens, the second bin contains sequences with 65 to 128 tokens, and so '
       'on. The bin size has to be an integer that can divide the value of '
-      '--target-seq-length. Default: {}'.format(defaults['--bin-size']),
+      '--target-seq-length. Default: %(default)s',
   )
   parser.add_argument(
       '--sample-ratio',
@@ -823,7 +852,7 @@ runtime with convergence impact.
       help='Not all articles/documents have to be included into the pretraining'
       ' dataset. This flag specifies the ratio of how many articles/documents '
       'are sampled from each corpus (i.e., --wikipedia, --books and '
-      '--common_crawl). Default: {}'.format(defaults['--sample-ratio']),
+      '--common_crawl). Default: %(default)s',
   )
   parser.add_argument(
       '--seed',
@@ -831,7 +860,7 @@ runtime with convergence impact.
       default=defaults['--seed'],
       help='The seed value for article/document sampling (i.e., '
       '--sample-ratio). Note that, the other part of this Dask pipeline is '
-      'non-deterministic. Default: {}'.format(defaults['--seed']),
+      'non-deterministic. Default: %(default)s',
   )
   parser.add_argument(
       '--duplicate-factor',
@@ -846,7 +875,7 @@ runtime with convergence impact.
       "to a different set of input sequences at different times. The "
       "--duplicate-factor flag specifies how many times the preprocessor "
       "repeats to create the input pairs from the same article/document. "
-      "Default: {}".format(defaults['--duplicate-factor']),
+      "Default: %(default)s",
   )
   parser.add_argument(
       '--vocab-file',
@@ -854,7 +883,7 @@ runtime with convergence impact.
       default=defaults['--vocab-file'],
       help='Either the path to a vocab file, or the model id of a pretrained '
       'model hosted inside a model repo on huggingface.co. '
-      'Default: {}'.format(defaults['--vocab-file']),
+      'Default: %(default)s',
   )
   attach_bool_arg(
       parser,
@@ -874,8 +903,7 @@ runtime with convergence impact.
       type=float,
       default=defaults['--masked-lm-ratio'],
       help='The ratio of the number of tokens to be masked when static masking '
-      'is enabled (i.e., when --masking is set). Default: {}'.format(
-          defaults['--masked-lm-ratio']),
+      'is enabled (i.e., when --masking is set). Default: %(default)s',
   )
   return parser
 
@@ -32,10 +32,9 @@ import time
 from mpi4py import MPI
 
 from lddl.types import File
-from lddl.utils import (get_all_files_paths_under, expand_outdir_and_mkdir,
-                        get_all_parquets_under, get_all_bin_ids,
-                        get_file_paths_for_bin_id, get_num_samples_of_parquet,
-                        attach_bool_arg)
+from lddl.utils import (expand_outdir_and_mkdir, get_all_parquets_under,
+                        get_all_bin_ids, get_file_paths_for_bin_id,
+                        get_num_samples_of_parquet, attach_bool_arg)
 
 
 class Shard:
@@ -23,13 +23,12 @@
 #
 
 import dask.bag as db
-import nltk
 import os
-import random
 
 
 def _filter_empty_strs(bag_strs):
-  return bag_strs.map(lambda s: s.strip()).filter(lambda s: len(s) > 0)
+  return bag_strs.map_partitions(
+      lambda strs: [s for s in map(str.strip, strs) if s])
 
 
 def _find_files_under(path, extensions={'.txt'}):
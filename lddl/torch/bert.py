@@ -32,7 +32,7 @@ from typing import List, Optional, Tuple, Union
 from collections import deque
 
 from lddl.utils import (get_all_parquets_under, get_all_bin_ids,
-                        get_file_paths_for_bin_id, deserialize_np_array)
+                        get_file_paths_for_bin_id, to_masked_lm_positions)
 from .dataloader import Binned, DataLoader
 from .datasets import ParquetDataset
 from .log import DatasetLogger
@@ -85,7 +85,7 @@ def _to_encoded_inputs(
     are_random_next.append(sample[2])
     if static_masking:
       all_masked_lm_positions.append(
-          torch.from_numpy(deserialize_np_array(sample[3]).astype(int)))
+          torch.from_numpy(to_masked_lm_positions(sample[3]).astype(int)))
       all_masked_lm_labels.append(sample[4].split())
   # Figure out the sequence length of this batch.
   batch_seq_len = max(
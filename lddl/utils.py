@@ -107,3 +107,11 @@ def deserialize_np_array(b):
   memfile.write(b)
   memfile.seek(0)
   return np.load(memfile)
+
+
+def to_masked_lm_positions(positions):
+  # Older shards store masked_lm_positions as a serialized np.ndarray rather
+  # than as a list<uint16> column.
+  if isinstance(positions, bytes):
+    return deserialize_np_array(positions)
+  return np.asarray(positions, dtype=np.uint16)